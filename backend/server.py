@@ -1,25 +1,75 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from gridfs import AsyncGridFSBucket
+from bson import Binary
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
+from collections import Counter
 import uuid
 from datetime import datetime, timezone, timedelta
 import httpx
 import base64
+import boto3
+from cachetools import TTLCache
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware so BSON dates come back as UTC-aware datetimes; minPoolSize keeps
+# connections open in the background so requests never pay the handshake
+client = AsyncMongoClient(
+    mongo_url,
+    tz_aware=True,
+    minPoolSize=5,
+    maxPoolSize=100,
+    maxIdleTimeMS=60000
+)
 db = client[os.environ['DB_NAME']]
+image_bucket = AsyncGridFSBucket(db)
+
+# Uploads up to this size are stored inline on the image doc, larger ones in GridFS
+INLINE_IMAGE_MAX_BYTES = 512 * 1024
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+# Optional object storage for uploads. When configured, image bytes never pass
+# through the API: the blob endpoint checks ownership and redirects to a
+# short-lived presigned URL. The frontend follows that redirect with XHR, so the
+# bucket needs a CORS rule allowing GET from the app's origin.
+IMAGE_S3_BUCKET = os.environ.get('IMAGE_S3_BUCKET')
+# Opt-in public CDN in front of the bucket. When set, uploads get a permanent
+# image_url that listings and /images/random hand out and that anyone holding it
+# can load, so only enable it for buckets meant to be world-readable.
+IMAGE_PUBLIC_CDN_URL = os.environ.get('IMAGE_PUBLIC_CDN_URL')
+s3_client = boto3.client('s3') if IMAGE_S3_BUCKET else None
+
+# Shared projections and pipeline stages; handlers only splice in per-request values
+_IMAGE_LISTING_PROJECTION = {"_id": 0, "image_data": 0, "blob": 0, "storage_key": 0}
+if not IMAGE_PUBLIC_CDN_URL:
+    # URLs stored while a public CDN was enabled are not handed out once it is off
+    _IMAGE_LISTING_PROJECTION["image_url"] = 0
+_SESSION_PROJECTION = {"_id": 0, "image_categories": 0}
+_SAMPLE_PROJECT_STAGE = {"$project": _IMAGE_LISTING_PROJECTION}
+_COUNT_BY_CATEGORY_STAGE = {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+_CATEGORIES_PIPELINE_TAIL = [
+    {"$group": {"_id": "$category"}},
+    {"$project": {"category": "$_id", "_id": 0}}
+]
+
+# Max documents per insert_many when adding images in bulk (e.g. Drive sync)
+IMAGE_INSERT_BATCH_SIZE = int(os.environ.get('IMAGE_INSERT_BATCH_SIZE', '1000'))
+
+# A startup migration still "running" after this long is assumed dead and taken over
+MIGRATION_LEASE = timedelta(minutes=10)
 
 # Create the main app
 app = FastAPI()
@@ -64,7 +114,11 @@ class Image(BaseModel):
     drive_file_id: Optional[str] = None
     drive_folder_id: Optional[str] = None
     thumbnail_url: Optional[str] = None
-    image_data: Optional[str] = None  # Base64 encoded for uploaded images
+    image_data: Optional[str] = None  # Base64 data URI (legacy uploads)
+    content_type: Optional[str] = None  # MIME type of uploaded bytes
+    gridfs_id: Optional[str] = None  # GridFS file id (the image_id) for large uploads
+    storage_key: Optional[str] = None  # Object key when stored in IMAGE_S3_BUCKET
+    image_url: Optional[str] = None  # Public CDN URL (only with IMAGE_PUBLIC_CDN_URL)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ReadingSession(BaseModel):
@@ -76,6 +130,8 @@ class ReadingSession(BaseModel):
     images_reviewed: int = 0
     correct_count: int = 0
     total_time_ms: int = 0
+    accuracy: float = 0.0  # correct_count / images_reviewed, maintained on each response
+    avg_time_ms: float = 0.0  # total_time_ms / images_reviewed
     started_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     completed_at: Optional[datetime] = None
     paused_at: Optional[datetime] = None
@@ -102,19 +158,61 @@ class DriveFolder(BaseModel):
     synced_at: Optional[datetime] = None
     image_count: int = 0
 
+# ================== REQUEST BODIES ==================
+
+class CreateSessionBody(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    session_id: Optional[str] = None
+
+class AddDriveFolderBody(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    drive_folder_id: str
+    folder_name: str
+    category: str
+
+class StartSessionBody(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    # Bounded so one start request cannot sample (and store a category map for) the whole library
+    image_count: int = Field(default=20, ge=1, le=500)
+
+class SubmitResponseBody(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    image_id: str
+    diagnosis: str
+    time_taken_ms: int
+
 # ================== AUTH HELPERS ==================
 
-async def get_current_user(request: Request) -> dict:
-    """Get current user from session token (cookie or header)"""
+# session_token -> (expires_at, user_doc); saves two lookups per authenticated request.
+# The cache is per process: pops on login/logout only reach the worker that handled
+# them, so other workers may keep accepting a revoked session (or serve a stale
+# user doc) for up to the 60s TTL.
+_session_cache: TTLCache = TTLCache(maxsize=10000, ttl=60)
+
+def get_session_token(request: Request) -> Optional[str]:
+    """Get the session token from the cookie or the Bearer header"""
     session_token = request.cookies.get("session_token")
     if not session_token:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
+    return session_token
+
+async def get_current_user(request: Request) -> dict:
+    """Get current user from session token (cookie or header)"""
+    session_token = get_session_token(request)
     
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    cached = _session_cache.get(session_token)
+    if cached:
+        expires_at, user_doc = cached
+        if expires_at < datetime.now(timezone.utc):
+            _session_cache.pop(session_token, None)
+            raise HTTPException(status_code=401, detail="Session expired")
+        return user_doc
+    
     session_doc = await db.user_sessions.find_one(
         {"session_token": session_token},
         {"_id": 0}
@@ -123,12 +221,10 @@ async def get_current_user(request: Request) -> dict:
     if not session_doc:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    # Check expiry with timezone awareness
+    # Check expiry (sessions created before dates were stored natively hold ISO strings)
     expires_at = session_doc["expires_at"]
     if isinstance(expires_at, str):
         expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
     
@@ -140,30 +236,30 @@ async def get_current_user(request: Request) -> dict:
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
+    _session_cache[session_token] = (expires_at, user_doc)
     return user_doc
 
 # ================== AUTH ENDPOINTS ==================
 
 @api_router.post("/auth/session")
-async def create_session(request: Request, response: Response):
+async def create_session(body: CreateSessionBody, request: Request, response: Response):
     """Exchange session_id for session_token"""
-    body = await request.json()
-    session_id = body.get("session_id")
+    session_id = body.session_id
     
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id required")
     
-    # Get user data from Emergent auth
-    async with httpx.AsyncClient() as client_http:
-        auth_response = await client_http.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
-        
-        if auth_response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session_id")
-        
-        user_data = auth_response.json()
+    # Get user data from Emergent auth (shared keep-alive client)
+    client_http = request.app.state.http
+    auth_response = await client_http.get(
+        "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+        headers={"X-Session-ID": session_id}
+    )
+    
+    if auth_response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid session_id")
+    
+    user_data = auth_response.json()
     
     # Check if user exists
     existing_user = await db.users.find_one(
@@ -174,13 +270,15 @@ async def create_session(request: Request, response: Response):
     if existing_user:
         user_id = existing_user["user_id"]
         # Update user data
+        user_updates = {
+            "name": user_data["name"],
+            "picture": user_data.get("picture")
+        }
         await db.users.update_one(
             {"user_id": user_id},
-            {"$set": {
-                "name": user_data["name"],
-                "picture": user_data.get("picture")
-            }}
+            {"$set": user_updates}
         )
+        user_doc = {**existing_user, **user_updates}
     else:
         # Create new user
         user_id = f"user_{uuid.uuid4().hex[:12]}"
@@ -189,9 +287,11 @@ async def create_session(request: Request, response: Response):
             "email": user_data["email"],
             "name": user_data["name"],
             "picture": user_data.get("picture"),
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(new_user)
+        del new_user["_id"]
+        user_doc = new_user
     
     # Create session
     session_token = user_data.get("session_token", str(uuid.uuid4()))
@@ -201,13 +301,20 @@ async def create_session(request: Request, response: Response):
         "session_id": str(uuid.uuid4()),
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     
-    # Remove old sessions for this user
-    await db.user_sessions.delete_many({"user_id": user_id})
-    await db.user_sessions.insert_one(session_doc)
+    # Replace any previous session for this user in a single round-trip
+    old_session = await db.user_sessions.find_one_and_replace(
+        {"user_id": user_id},
+        session_doc,
+        projection={"session_token": 1},
+        upsert=True
+    )
+    if old_session:
+        _session_cache.pop(old_session["session_token"], None)
+    _session_cache.pop(session_token, None)
     
     # Set cookie
     response.set_cookie(
@@ -220,8 +327,6 @@ async def create_session(request: Request, response: Response):
         max_age=7 * 24 * 60 * 60
     )
     
-    user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-    
     # Return user data with session token for frontend storage
     return {
         **user_doc,
@@ -237,13 +342,67 @@ async def get_me(request: Request):
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
     """Logout user"""
-    session_token = request.cookies.get("session_token")
+    session_token = get_session_token(request)
     if session_token:
+        _session_cache.pop(session_token, None)
         await db.user_sessions.delete_many({"session_token": session_token})
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
 
+# ================== IMAGE HELPERS ==================
+
+async def adjust_category_counts(user_id: str, deltas: dict):
+    """Apply per-category image count changes to image_category_counts"""
+    # Categories are free text, so they are stored as values, never as field names
+    ops = [
+        UpdateOne(
+            {"user_id": user_id, "category": category},
+            {"$inc": {"count": n}},
+            upsert=n > 0
+        )
+        for category, n in deltas.items()
+        if n
+    ]
+    if ops:
+        await db.image_category_counts.bulk_write(ops, ordered=False)
+
+def servable_content_type(content_type: Optional[str]) -> str:
+    """Keep image types as given; anything else is served as opaque bytes"""
+    if content_type and content_type.startswith("image/"):
+        return content_type
+    return "application/octet-stream"
+
+async def discard_stored_bytes(image: dict):
+    """Remove the GridFS file or S3 object behind an image doc; failures are logged, not raised"""
+    try:
+        if image.get("gridfs_id") is not None:
+            await image_bucket.delete(image["gridfs_id"])
+        elif image.get("storage_key") is not None:
+            await asyncio.to_thread(
+                s3_client.delete_object,
+                Bucket=IMAGE_S3_BUCKET,
+                Key=image["storage_key"]
+            )
+    except Exception:
+        logger.exception(
+            "Failed to remove stored bytes of image %s",
+            image.get("gridfs_id") or image.get("storage_key")
+        )
+
+async def insert_images(user_id: str, image_docs: list):
+    """Insert image docs in unordered batches and update the category counts"""
+    for i in range(0, len(image_docs), IMAGE_INSERT_BATCH_SIZE):
+        await db.images.insert_many(
+            image_docs[i:i + IMAGE_INSERT_BATCH_SIZE],
+            ordered=False
+        )
+    
+    await adjust_category_counts(
+        user_id,
+        Counter(doc["category"] for doc in image_docs)
+    )
+
 # ================== IMAGE ENDPOINTS ==================
 
 @api_router.get("/images")
@@ -255,7 +414,7 @@ async def get_images(request: Request, category: Optional[str] = None):
     if category:
         query["category"] = category
     
-    images = await db.images.find(query, {"_id": 0}).to_list(1000)
+    images = await db.images.find(query, _IMAGE_LISTING_PROJECTION).to_list(1000)
     return images
 
 @api_router.post("/images/upload")
@@ -267,12 +426,8 @@ async def upload_image(
     """Upload a medical image"""
     user = await get_current_user(request)
     
-    # Read and encode file
-    content = await file.read()
-    base64_data = base64.b64encode(content).decode('utf-8')
-    
-    # Determine content type
-    content_type = file.content_type or 'image/jpeg'
+    # Determine content type; the blob endpoint echoes it back, so only image types are kept
+    content_type = servable_content_type(file.content_type or 'image/jpeg')
     
     image_doc = {
         "image_id": f"img_{uuid.uuid4().hex[:12]}",
@@ -280,28 +435,164 @@ async def upload_image(
         "filename": file.filename,
         "category": category.lower(),
         "source": "upload",
-        "image_data": f"data:{content_type};base64,{base64_data}",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "content_type": content_type,
+        "created_at": datetime.now(timezone.utc)
     }
     
-    await db.images.insert_one(image_doc)
+    # Store raw bytes; the browser fetches them from the CDN or the blob endpoint.
+    # Only the inline limit is buffered, larger files are streamed into GridFS.
+    if s3_client:
+        storage_key = f"users/{user['user_id']}/{image_doc['image_id']}"
+        await asyncio.to_thread(
+            s3_client.upload_fileobj,
+            file.file,
+            IMAGE_S3_BUCKET,
+            storage_key,
+            ExtraArgs={"ContentType": content_type}
+        )
+        image_doc["storage_key"] = storage_key
+        if IMAGE_PUBLIC_CDN_URL:
+            image_doc["image_url"] = f"{IMAGE_PUBLIC_CDN_URL.rstrip('/')}/{storage_key}"
+    else:
+        content = await file.read(INLINE_IMAGE_MAX_BYTES + 1)
+        if len(content) > INLINE_IMAGE_MAX_BYTES:
+            grid_in = image_bucket.open_upload_stream_with_id(
+                image_doc["image_id"],
+                file.filename or image_doc["image_id"],
+                metadata={"contentType": content_type}
+            )
+            try:
+                await grid_in.write(content)
+                while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                    await grid_in.write(chunk)
+            except Exception:
+                await grid_in.abort()
+                raise
+            await grid_in.close()
+            image_doc["gridfs_id"] = image_doc["image_id"]
+        else:
+            image_doc["blob"] = Binary(content)
+    
+    # The bytes are already committed; don't leave them orphaned if the doc never lands
+    try:
+        await db.images.insert_one(image_doc)
+    except Exception:
+        await discard_stored_bytes(image_doc)
+        raise
+    # An image that can't be counted is removed again, so the stats never drift from it
+    try:
+        await adjust_category_counts(user["user_id"], {image_doc["category"]: 1})
+    except Exception:
+        logger.exception("Failed to count image %s, removing it", image_doc["image_id"])
+        await db.images.delete_one({"image_id": image_doc["image_id"]})
+        await discard_stored_bytes(image_doc)
+        raise
     del image_doc["_id"]
+    image_doc.pop("blob", None)
+    image_doc.pop("storage_key", None)
     
     return image_doc
 
+@api_router.get("/images/{image_id}/blob")
+async def get_image_blob(image_id: str, request: Request):
+    """Serve the stored bytes of an uploaded image"""
+    user = await get_current_user(request)
+    
+    image = await db.images.find_one({
+        "image_id": image_id,
+        "user_id": user["user_id"]
+    }, {"_id": 0, "content_type": 1, "blob": 1, "gridfs_id": 1, "image_data": 1, "storage_key": 1, "image_url": 1})
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    if image.get("storage_key") is not None:
+        # Presigned by default; a stored public URL is only a fallback without the bucket
+        if s3_client:
+            url = await asyncio.to_thread(
+                s3_client.generate_presigned_url,
+                "get_object",
+                Params={"Bucket": IMAGE_S3_BUCKET, "Key": image["storage_key"]},
+                ExpiresIn=3600
+            )
+        elif IMAGE_PUBLIC_CDN_URL and image.get("image_url"):
+            url = image["image_url"]
+        else:
+            raise HTTPException(status_code=503, detail="Image storage is not configured")
+        return RedirectResponse(url)
+    
+    # The bytes are user supplied: stop browsers sniffing them into something
+    # renderable and sandbox anything (e.g. SVG) opened directly
+    cache_headers = {
+        "Cache-Control": "private, max-age=86400",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; sandbox"
+    }
+    
+    if image.get("gridfs_id") is not None:
+        grid_out = await image_bucket.open_download_stream(image["gridfs_id"])
+        
+        async def stream_chunks():
+            while chunk := await grid_out.readchunk():
+                yield chunk
+        
+        return StreamingResponse(
+            stream_chunks(),
+            media_type=servable_content_type(image.get("content_type")),
+            headers=cache_headers
+        )
+    
+    if image.get("blob") is not None:
+        return Response(
+            content=bytes(image["blob"]),
+            media_type=servable_content_type(image.get("content_type")),
+            headers=cache_headers
+        )
+    
+    if image.get("image_data"):
+        # Legacy uploads embedded a base64 data URI in the document
+        header, base64_data = image["image_data"].split(",", 1)
+        return Response(
+            content=base64.b64decode(base64_data),
+            media_type=servable_content_type(header[len("data:"):].split(";")[0]),
+            headers=cache_headers
+        )
+    
+    raise HTTPException(status_code=404, detail="Image data not found")
+
 @api_router.delete("/images/{image_id}")
 async def delete_image(image_id: str, request: Request):
     """Delete an image"""
     user = await get_current_user(request)
     
-    result = await db.images.delete_one({
-        "image_id": image_id,
-        "user_id": user["user_id"]
-    })
+    image_filter = {"image_id": image_id, "user_id": user["user_id"]}
+    if not s3_client:
+        # Object-stored images can't be removed without the bucket, so leave them in place
+        image_filter["storage_key"] = {"$exists": False}
+    
+    image = await db.images.find_one_and_delete(
+        image_filter,
+        projection={"gridfs_id": 1, "storage_key": 1, "category": 1}
+    )
     
-    if result.deleted_count == 0:
+    if not image:
+        if not s3_client and await db.images.count_documents(
+            {"image_id": image_id, "user_id": user["user_id"]},
+            limit=1
+        ):
+            raise HTTPException(status_code=503, detail="Image storage is not configured")
         raise HTTPException(status_code=404, detail="Image not found")
     
+    # The doc is gone first, so a failure below can only orphan bytes, never leave
+    # a listed image whose bytes are missing
+    await discard_stored_bytes(image)
+    
+    # The image is already gone, so a failed count update is logged rather than reported
+    try:
+        await adjust_category_counts(user["user_id"], {image["category"]: -1})
+    except Exception:
+        logger.exception("Failed to uncount deleted image %s", image_id)
+    
     return {"message": "Image deleted"}
 
 @api_router.get("/images/random")
@@ -313,10 +604,11 @@ async def get_random_images(request: Request, count: int = 20):
     pipeline = [
         {"$match": {"user_id": user["user_id"]}},
         {"$sample": {"size": count}},
-        {"$project": {"_id": 0}}
+        _SAMPLE_PROJECT_STAGE
     ]
     
-    images = await db.images.aggregate(pipeline).to_list(count)
+    cursor = await db.images.aggregate(pipeline)
+    images = await cursor.to_list(count)
     return images
 
 @api_router.get("/images/stats")
@@ -324,33 +616,36 @@ async def get_image_stats(request: Request):
     """Get image statistics by category"""
     user = await get_current_user(request)
     
-    pipeline = [
-        {"$match": {"user_id": user["user_id"]}},
-        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-        {"$project": {"category": "$_id", "count": 1, "_id": 0}}
-    ]
-    
-    stats = await db.images.aggregate(pipeline).to_list(100)
+    # Counts are kept up to date on every upload/delete (see adjust_category_counts)
+    stats = await db.image_category_counts.find(
+        {"user_id": user["user_id"], "count": {"$gt": 0}},
+        {"_id": 0, "category": 1, "count": 1}
+    ).to_list(100)
     total = sum(s["count"] for s in stats)
     
     return {"categories": stats, "total": total}
 
+# ================== DRIVE HELPERS ==================
+
+async def fetch_drive_files(folder: dict) -> list:
+    """List image files in a Drive folder (needs the Google Drive API, not wired up yet)"""
+    return []
+
 # ================== DRIVE ENDPOINTS ==================
 
 @api_router.post("/drive/folders")
-async def add_drive_folder(request: Request):
+async def add_drive_folder(body: AddDriveFolderBody, request: Request):
     """Add a Google Drive folder for syncing"""
     user = await get_current_user(request)
-    body = await request.json()
     
     folder_doc = {
         "folder_id": f"folder_{uuid.uuid4().hex[:12]}",
         "user_id": user["user_id"],
-        "drive_folder_id": body["drive_folder_id"],
-        "folder_name": body["folder_name"],
-        "category": body["category"].lower(),
+        "drive_folder_id": body.drive_folder_id,
+        "folder_name": body.folder_name,
+        "category": body.category.lower(),
         "image_count": 0,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.drive_folders.insert_one(folder_doc)
@@ -384,12 +679,26 @@ async def delete_drive_folder(folder_id: str, request: Request):
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    # Delete folder and its images
-    await db.drive_folders.delete_one({"folder_id": folder_id})
-    await db.images.delete_many({
+    folder_images = {
         "user_id": user["user_id"],
         "drive_folder_id": folder["drive_folder_id"]
-    })
+    }
+    
+    # Tally what is about to be removed so the stored counts can be adjusted once
+    pipeline = [
+        {"$match": folder_images},
+        _COUNT_BY_CATEGORY_STAGE
+    ]
+    cursor = await db.images.aggregate(pipeline)
+    removed = await cursor.to_list(100)
+    
+    # Delete folder and its images
+    await db.drive_folders.delete_one({"folder_id": folder_id})
+    await db.images.delete_many(folder_images)
+    await adjust_category_counts(
+        user["user_id"],
+        {r["_id"]: -r["count"] for r in removed}
+    )
     
     return {"message": "Folder and images deleted"}
 
@@ -406,59 +715,100 @@ async def sync_drive_folder(folder_id: str, request: Request):
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    # Note: In production, this would use Google Drive API to fetch actual images
-    # For now, we'll return a message indicating the folder is ready for manual upload
+    # Note: Until the Google Drive API is connected no files are returned,
+    # so the folder is ready for manual upload
+    drive_files = await fetch_drive_files(folder)
+    
+    synced_at = datetime.now(timezone.utc)
+    image_docs = [
+        {
+            "image_id": f"img_{uuid.uuid4().hex[:12]}",
+            "user_id": user["user_id"],
+            "filename": f["name"],
+            "category": folder["category"],
+            "source": "drive",
+            "drive_file_id": f["id"],
+            "drive_folder_id": folder["drive_folder_id"],
+            "thumbnail_url": f.get("thumbnailLink"),
+            "created_at": synced_at
+        }
+        for f in drive_files
+    ]
+    
+    # One insert_many per batch rather than an insert_one per file
+    if image_docs:
+        await insert_images(user["user_id"], image_docs)
     
     await db.drive_folders.update_one(
         {"folder_id": folder_id},
-        {"$set": {"synced_at": datetime.now(timezone.utc).isoformat()}}
+        {
+            "$set": {"synced_at": synced_at},
+            "$inc": {"image_count": len(image_docs)}
+        }
     )
     
     return {
         "message": "Folder synced",
         "folder_id": folder_id,
+        "images_synced": len(image_docs),
         "note": "Upload images manually or connect Google Drive API for auto-sync"
     }
 
+# ================== READING SESSION HELPERS ==================
+
+async def raise_session_state_error(session_id: str, user_id: str, detail: str):
+    """Raise 404 if the session doesn't exist for the user, otherwise 400 with detail"""
+    exists = await db.reading_sessions.count_documents(
+        {"session_id": session_id, "user_id": user_id},
+        limit=1
+    )
+    
+    if not exists:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    raise HTTPException(status_code=400, detail=detail)
+
 # ================== READING SESSION ENDPOINTS ==================
 
 @api_router.post("/sessions/start")
-async def start_session(request: Request):
+async def start_session(body: StartSessionBody, request: Request):
     """Start a new reading session"""
     user = await get_current_user(request)
-    body = await request.json()
     
-    image_count = body.get("image_count", 20)
+    image_count = body.image_count
     
-    # Check if user has images
-    total_images = await db.images.count_documents({"user_id": user["user_id"]})
-    if total_images == 0:
+    # Get random images for this session; $sample returns fewer when the user has fewer
+    pipeline = [
+        {"$match": {"user_id": user["user_id"]}},
+        {"$sample": {"size": image_count}},
+        _SAMPLE_PROJECT_STAGE
+    ]
+    
+    cursor = await db.images.aggregate(pipeline)
+    images = await cursor.to_list(image_count)
+    if not images:
         raise HTTPException(status_code=400, detail="No images available. Please upload images first.")
     
-    # Create session
+    # Create session, remembering each image's category so responses can be
+    # graded without looking the image up again
     session_doc = {
         "session_id": f"session_{uuid.uuid4().hex[:12]}",
         "user_id": user["user_id"],
         "status": "in_progress",
-        "total_images": min(image_count, total_images),
+        "total_images": len(images),
         "images_reviewed": 0,
         "correct_count": 0,
         "total_time_ms": 0,
+        "accuracy": 0.0,
+        "avg_time_ms": 0.0,
         "pause_duration_ms": 0,
-        "started_at": datetime.now(timezone.utc).isoformat()
+        "started_at": datetime.now(timezone.utc),
+        "image_categories": {img["image_id"]: img["category"].lower() for img in images}
     }
     
     await db.reading_sessions.insert_one(session_doc)
     del session_doc["_id"]
-    
-    # Get random images for this session
-    pipeline = [
-        {"$match": {"user_id": user["user_id"]}},
-        {"$sample": {"size": session_doc["total_images"]}},
-        {"$project": {"_id": 0}}
-    ]
-    
-    images = await db.images.aggregate(pipeline).to_list(session_doc["total_images"])
+    del session_doc["image_categories"]
     
     return {
         "session": session_doc,
@@ -466,16 +816,21 @@ async def start_session(request: Request):
     }
 
 @api_router.post("/sessions/{session_id}/response")
-async def submit_response(session_id: str, request: Request):
+async def submit_response(session_id: str, body: SubmitResponseBody, request: Request):
     """Submit a diagnosis response for an image"""
     user = await get_current_user(request)
-    body = await request.json()
+    
+    # Only this image's entry of the category map is needed. The id becomes part of a
+    # field path, so ids that can't be one skip the map and fall back to the image lookup.
+    session_projection = {"_id": 0, "status": 1}
+    if body.image_id and "." not in body.image_id and not body.image_id.startswith("$"):
+        session_projection[f"image_categories.{body.image_id}"] = 1
     
     # Get session
     session = await db.reading_sessions.find_one({
         "session_id": session_id,
         "user_id": user["user_id"]
-    }, {"_id": 0})
+    }, session_projection)
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -483,42 +838,50 @@ async def submit_response(session_id: str, request: Request):
     if session["status"] not in ["in_progress", "paused"]:
         raise HTTPException(status_code=400, detail="Session is not active")
     
-    # Get image to verify category
-    image = await db.images.find_one({"image_id": body["image_id"]}, {"_id": 0})
-    if not image:
-        raise HTTPException(status_code=404, detail="Image not found")
+    # Category was recorded at session start; older sessions fall back to the image
+    actual_category = session.get("image_categories", {}).get(body.image_id)
+    if actual_category is None:
+        image = await db.images.find_one({"image_id": body.image_id}, {"_id": 0, "category": 1})
+        if not image:
+            raise HTTPException(status_code=404, detail="Image not found")
+        actual_category = image["category"].lower()
     
     # Determine if correct
-    user_diagnosis = body["diagnosis"].lower()
-    actual_category = image["category"].lower()
+    user_diagnosis = body.diagnosis.lower()
     is_correct = user_diagnosis == actual_category
     
     # Create response
     response_doc = {
         "response_id": f"resp_{uuid.uuid4().hex[:12]}",
         "session_id": session_id,
-        "image_id": body["image_id"],
+        "image_id": body.image_id,
         "user_diagnosis": user_diagnosis,
         "actual_category": actual_category,
         "is_correct": is_correct,
-        "time_taken_ms": body["time_taken_ms"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "time_taken_ms": body.time_taken_ms,
+        "created_at": datetime.now(timezone.utc)
     }
     
-    await db.session_responses.insert_one(response_doc)
-    
-    # Update session stats
-    update_data = {
-        "$inc": {
-            "images_reviewed": 1,
-            "total_time_ms": body["time_taken_ms"],
-            "correct_count": 1 if is_correct else 0
-        }
-    }
+    # Update session stats and the derived accuracy/average time in one pipeline update
+    update_data = [
+        {"$set": {
+            "images_reviewed": {"$add": ["$images_reviewed", 1]},
+            "total_time_ms": {"$add": ["$total_time_ms", body.time_taken_ms]},
+            "correct_count": {"$add": ["$correct_count", 1 if is_correct else 0]}
+        }},
+        {"$set": {
+            "accuracy": {"$divide": ["$correct_count", "$images_reviewed"]},
+            "avg_time_ms": {"$divide": ["$total_time_ms", "$images_reviewed"]}
+        }}
+    ]
     
-    await db.reading_sessions.update_one(
-        {"session_id": session_id},
-        update_data
+    # The two writes are independent, so issue them concurrently
+    await asyncio.gather(
+        db.session_responses.insert_one(response_doc),
+        db.reading_sessions.update_one(
+            {"session_id": session_id},
+            update_data
+        )
     )
     
     return {
@@ -532,25 +895,18 @@ async def pause_session(session_id: str, request: Request):
     """Pause a reading session"""
     user = await get_current_user(request)
     
-    session = await db.reading_sessions.find_one({
-        "session_id": session_id,
-        "user_id": user["user_id"]
-    }, {"_id": 0})
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if session["status"] != "in_progress":
-        raise HTTPException(status_code=400, detail="Session is not in progress")
-    
-    await db.reading_sessions.update_one(
-        {"session_id": session_id},
+    # The status check is part of the filter, so the transition is a single atomic write
+    result = await db.reading_sessions.update_one(
+        {"session_id": session_id, "user_id": user["user_id"], "status": "in_progress"},
         {"$set": {
             "status": "paused",
-            "paused_at": datetime.now(timezone.utc).isoformat()
+            "paused_at": datetime.now(timezone.utc)
         }}
     )
     
+    if result.matched_count == 0:
+        await raise_session_state_error(session_id, user["user_id"], "Session is not in progress")
+    
     return {"message": "Session paused"}
 
 @api_router.post("/sessions/{session_id}/resume")
@@ -558,39 +914,47 @@ async def resume_session(session_id: str, request: Request):
     """Resume a paused session"""
     user = await get_current_user(request)
     
-    session = await db.reading_sessions.find_one({
-        "session_id": session_id,
-        "user_id": user["user_id"]
-    }, {"_id": 0})
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if session["status"] != "paused":
-        raise HTTPException(status_code=400, detail="Session is not paused")
+    # Accumulate the pause duration server-side; a missing paused_at counts as no pause
+    now = datetime.now(timezone.utc)
+    session_filter = {"session_id": session_id, "user_id": user["user_id"], "status": "paused"}
+    
+    result = await db.reading_sessions.update_one(
+        {**session_filter, "paused_at": {"$not": {"$type": "string"}}},
+        [{"$set": {
+            "status": "in_progress",
+            "paused_at": None,
+            "pause_duration_ms": {"$add": [
+                "$pause_duration_ms",
+                {"$subtract": [now, {"$ifNull": ["$paused_at", now]}]}
+            ]}
+        }}]
+    )
     
-    # Calculate pause duration
-    paused_at = session.get("paused_at")
-    if paused_at:
-        if isinstance(paused_at, str):
-            paused_at = datetime.fromisoformat(paused_at)
-        if paused_at.tzinfo is None:
-            paused_at = paused_at.replace(tzinfo=timezone.utc)
-        
-        pause_duration = (datetime.now(timezone.utc) - paused_at).total_seconds() * 1000
-        
-        await db.reading_sessions.update_one(
-            {"session_id": session_id},
-            {
-                "$set": {"status": "in_progress", "paused_at": None},
-                "$inc": {"pause_duration_ms": int(pause_duration)}
-            }
-        )
-    else:
-        await db.reading_sessions.update_one(
-            {"session_id": session_id},
-            {"$set": {"status": "in_progress"}}
+    if result.matched_count == 0:
+        # Sessions paused by older builds hold an ISO string, which is parsed here;
+        # the update only applies if the session hasn't changed in between
+        legacy = await db.reading_sessions.find_one(
+            {**session_filter, "paused_at": {"$type": "string"}},
+            {"_id": 0, "paused_at": 1}
         )
+        if legacy:
+            pause_duration = 0
+            if legacy["paused_at"]:
+                paused_at = datetime.fromisoformat(legacy["paused_at"])
+                if paused_at.tzinfo is None:
+                    paused_at = paused_at.replace(tzinfo=timezone.utc)
+                pause_duration = (now - paused_at).total_seconds() * 1000
+            
+            result = await db.reading_sessions.update_one(
+                {**session_filter, "paused_at": legacy["paused_at"]},
+                {
+                    "$set": {"status": "in_progress", "paused_at": None},
+                    "$inc": {"pause_duration_ms": int(pause_duration)}
+                }
+            )
+    
+    if result.matched_count == 0:
+        await raise_session_state_error(session_id, user["user_id"], "Session is not paused")
     
     return {"message": "Session resumed"}
 
@@ -599,33 +963,25 @@ async def complete_session(session_id: str, request: Request):
     """Complete a reading session"""
     user = await get_current_user(request)
     
-    session = await db.reading_sessions.find_one({
-        "session_id": session_id,
-        "user_id": user["user_id"]
-    }, {"_id": 0})
-    
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    await db.reading_sessions.update_one(
-        {"session_id": session_id},
-        {"$set": {
-            "status": "completed",
-            "completed_at": datetime.now(timezone.utc).isoformat()
-        }}
+    # Mark complete and fetch responses concurrently; the update returns the new session
+    updated_session, responses = await asyncio.gather(
+        db.reading_sessions.find_one_and_update(
+            {"session_id": session_id, "user_id": user["user_id"]},
+            {"$set": {
+                "status": "completed",
+                "completed_at": datetime.now(timezone.utc)
+            }},
+            projection=_SESSION_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        ),
+        db.session_responses.find(
+            {"session_id": session_id},
+            {"_id": 0}
+        ).to_list(1000)
     )
     
-    # Get responses for this session
-    responses = await db.session_responses.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Get updated session
-    updated_session = await db.reading_sessions.find_one(
-        {"session_id": session_id},
-        {"_id": 0}
-    )
+    if not updated_session:
+        raise HTTPException(status_code=404, detail="Session not found")
     
     return {
         "session": updated_session,
@@ -641,7 +997,7 @@ async def quit_session(session_id: str, request: Request):
         {"session_id": session_id, "user_id": user["user_id"]},
         {"$set": {
             "status": "quit",
-            "completed_at": datetime.now(timezone.utc).isoformat()
+            "completed_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -654,7 +1010,7 @@ async def get_sessions(request: Request):
     
     sessions = await db.reading_sessions.find(
         {"user_id": user["user_id"]},
-        {"_id": 0}
+        _SESSION_PROJECTION
     ).sort("started_at", -1).to_list(100)
     
     return sessions
@@ -664,19 +1020,20 @@ async def get_session(session_id: str, request: Request):
     """Get a specific reading session with responses"""
     user = await get_current_user(request)
     
-    session = await db.reading_sessions.find_one({
-        "session_id": session_id,
-        "user_id": user["user_id"]
-    }, {"_id": 0})
+    session, responses = await asyncio.gather(
+        db.reading_sessions.find_one({
+            "session_id": session_id,
+            "user_id": user["user_id"]
+        }, _SESSION_PROJECTION),
+        db.session_responses.find(
+            {"session_id": session_id},
+            {"_id": 0}
+        ).to_list(1000)
+    )
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    responses = await db.session_responses.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
     return {
         "session": session,
         "responses": responses
@@ -690,35 +1047,35 @@ async def get_session_csv(session_id: str, request: Request):
     session = await db.reading_sessions.find_one({
         "session_id": session_id,
         "user_id": user["user_id"]
-    }, {"_id": 0})
+    }, _SESSION_PROJECTION)
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    responses = await db.session_responses.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Build CSV
-    csv_lines = ["Image ID,Your Diagnosis,Actual Category,Correct,Time (ms)"]
-    for r in responses:
-        csv_lines.append(f"{r['image_id']},{r['user_diagnosis']},{r['actual_category']},{r['is_correct']},{r['time_taken_ms']}")
-    
-    # Add summary
-    csv_lines.append("")
-    csv_lines.append("SUMMARY")
-    csv_lines.append(f"Total Images,{session['images_reviewed']}")
-    csv_lines.append(f"Correct,{session['correct_count']}")
-    accuracy = (session['correct_count'] / session['images_reviewed'] * 100) if session['images_reviewed'] > 0 else 0
-    csv_lines.append(f"Accuracy,{accuracy:.1f}%")
-    avg_time = session['total_time_ms'] / session['images_reviewed'] if session['images_reviewed'] > 0 else 0
-    csv_lines.append(f"Avg Time (ms),{avg_time:.0f}")
-    
-    csv_content = "\n".join(csv_lines)
-    
-    return Response(
-        content=csv_content,
+    # Stream CSV rows straight from the cursor
+    async def generate_csv():
+        yield "Image ID,Your Diagnosis,Actual Category,Correct,Time (ms)\n"
+        async for r in db.session_responses.find({"session_id": session_id}, {"_id": 0}):
+            yield f"{r['image_id']},{r['user_diagnosis']},{r['actual_category']},{r['is_correct']},{r['time_taken_ms']}\n"
+        
+        # Add summary (sessions predating the stored accuracy/avg_time_ms fields are derived)
+        if "accuracy" in session:
+            accuracy = session['accuracy'] * 100
+            avg_time = session['avg_time_ms']
+        else:
+            accuracy = (session['correct_count'] / session['images_reviewed'] * 100) if session['images_reviewed'] > 0 else 0
+            avg_time = session['total_time_ms'] / session['images_reviewed'] if session['images_reviewed'] > 0 else 0
+        yield "\n".join([
+            "",
+            "SUMMARY",
+            f"Total Images,{session['images_reviewed']}",
+            f"Correct,{session['correct_count']}",
+            f"Accuracy,{accuracy:.1f}%",
+            f"Avg Time (ms),{avg_time:.0f}"
+        ])
+    
+    return StreamingResponse(
+        generate_csv(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=session_{session_id}.csv"}
     )
@@ -732,11 +1089,11 @@ async def get_categories(request: Request):
     
     pipeline = [
         {"$match": {"user_id": user["user_id"]}},
-        {"$group": {"_id": "$category"}},
-        {"$project": {"category": "$_id", "_id": 0}}
+        *_CATEGORIES_PIPELINE_TAIL
     ]
     
-    categories = await db.images.aggregate(pipeline).to_list(100)
+    cursor = await db.images.aggregate(pipeline)
+    categories = await cursor.to_list(100)
     return [c["category"] for c in categories]
 
 # ================== ROOT ENDPOINT ==================
@@ -756,6 +1113,94 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def warmup_db_client():
+    # Open a pooled connection before the first request arrives
+    await db.command("ping")
+    await db.users.find_one({}, {"_id": 1})
+
+@app.on_event("startup")
+async def create_indexes():
+    # Only fields used in query predicates are indexed, to keep writes cheap
+    await db.user_sessions.create_index("user_id", unique=True)
+    await db.user_sessions.create_index("session_token", unique=True)
+    await db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+    await db.images.create_index("image_id", unique=True)
+    await db.images.create_index([("user_id", 1), ("category", 1)])
+    await db.images.create_index([("user_id", 1), ("drive_folder_id", 1)])
+    await db.reading_sessions.create_index("session_id", unique=True)
+    await db.reading_sessions.create_index([("user_id", 1), ("started_at", -1)])
+    await db.session_responses.create_index("session_id")
+    await db.drive_folders.create_index("user_id")
+    await db.image_category_counts.create_index([("user_id", 1), ("category", 1)], unique=True)
+
+@app.on_event("startup")
+async def backfill_category_counts():
+    # One-off: count images uploaded before image_category_counts was maintained.
+    # One worker claims the marker and the others wait here until it is "done", so
+    # no request can $inc a count while it is being computed. That keeps "replace"
+    # safe, and a retry after a partial $merge just rewrites the same totals.
+    while True:
+        claimed_at = datetime.now(timezone.utc)
+        try:
+            # Matches an unfinished marker whose lease ran out (or one written before
+            # markers had a status); a missing marker is inserted by the upsert
+            await db.migrations.update_one(
+                {
+                    "_id": "image_category_counts",
+                    "status": {"$ne": "done"},
+                    "$or": [
+                        {"started_at": {"$lt": claimed_at - MIGRATION_LEASE}},
+                        {"started_at": {"$exists": False}}
+                    ]
+                },
+                {"$set": {"status": "running", "started_at": claimed_at}},
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            marker = await db.migrations.find_one({"_id": "image_category_counts"}, {"status": 1})
+            if marker and marker.get("status") == "done":
+                return
+            await asyncio.sleep(1)
+    
+    try:
+        await db.images.aggregate([
+            {"$group": {
+                "_id": {"user_id": "$user_id", "category": "$category"},
+                "count": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                "category": "$_id.category",
+                "count": 1
+            }},
+            {"$merge": {
+                "into": "image_category_counts",
+                "on": ["user_id", "category"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ])
+    except Exception:
+        # Hand the backfill straight to the next worker instead of waiting out the lease
+        await db.migrations.delete_one({"_id": "image_category_counts", "started_at": claimed_at})
+        raise
+    
+    await db.migrations.update_one(
+        {"_id": "image_category_counts"},
+        {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}}
+    )
+
+@app.on_event("startup")
+async def startup_http_client():
+    app.state.http = httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await app.state.http.aclose()
+    await client.close()
@@ -1,73 +1,201 @@
-import requests
+import asyncio
+import httpx
 import sys
 import json
 import base64
-from datetime import datetime
-import subprocess
+from datetime import datetime, timezone, timedelta
+from pymongo import AsyncMongoClient
 import os
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(content):
+    """Parse a JSON response body, using orjson when it is installed"""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_pretty(data):
+    """Pretty-print JSON with two-space indents, using orjson when it is installed"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(data, indent=2)
+
+# Set TEST_VERBOSE=1 to print pretty-printed response bodies
+VERBOSE = os.environ.get("TEST_VERBOSE") == "1"
+
+# 1x1 pixel PNG used by the upload test
+TEST_PNG_BYTES = base64.b64decode(b"iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg==")
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """Retry transient gateway errors with exponential backoff over the same connection pool"""
+
+    # A 502/503/504 doesn't say whether the backend already ran the request, so only
+    # methods that are safe to repeat are retried (never POST, e.g. submitting a
+    # response twice). Connect errors, where nothing was sent, are retried by the pool.
+    def __init__(self, transport, total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                 allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"])):
+        self._transport = transport
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.allowed_methods = allowed_methods
+
+    async def handle_async_request(self, request):
+        for attempt in range(self.total + 1):
+            response = await self._transport.handle_async_request(request)
+            if (response.status_code not in self.status_forcelist
+                    or request.method not in self.allowed_methods
+                    or attempt == self.total):
+                return response
+            await response.aclose()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def aclose(self):
+        await self._transport.aclose()
+
 class MedReadAPITester:
+    _IMAGE_UPLOAD_FORM_DATA = {'category': 'cancer'}
+
     def __init__(self, base_url="https://mediscan-pro.preview.emergentagent.com"):
         self.base_url = base_url
+        self._api_base = f"{base_url}/api/"
         self.session_token = None
         self.user_id = None
         self.tests_run = 0
         self.tests_passed = 0
         self.session_id = None
+        self._session_url = None
         self.image_id = None
+        self.other_user_id = None
+        self.other_session_token = None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, headers=None):
-        """Run a single API test"""
-        url = f"{self.base_url}/api/{endpoint}" if not endpoint.startswith('http') else endpoint
-        test_headers = {'Content-Type': 'application/json'}
-        
-        if headers:
-            test_headers.update(headers)
-        
-        if self.session_token and 'Authorization' not in test_headers:
-            test_headers['Authorization'] = f'Bearer {self.session_token}'
+    async def __aenter__(self):
+        """Open the HTTP client and MongoDB connection shared by setup, tests and cleanup"""
+        # One pooled, kept-alive async client; concurrent tests share it on a single event loop.
+        # Over HTTP/2 they are multiplexed as streams on one connection; the limits only
+        # matter if the server falls back to HTTP/1.1.
+        # (connection failures are retried by the pool, 502/503/504 by RetryTransport)
+        self.session = httpx.AsyncClient(
+            headers={"User-Agent": "MedReadAPITester"},
+            transport=RetryTransport(httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+                retries=3
+            )),
+            timeout=30.0
+        )
+        # Talk to MongoDB directly instead of spawning mongosh for setup/cleanup
+        self.mongo_client = AsyncMongoClient(
+            os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+            maxPoolSize=5
+        )
+        self.mongo = self.mongo_client["test_database"]
+        return self
+
+    async def __aexit__(self, *exc):
+        # Clean up even if a test crashed, then release both connection pools
+        try:
+            await self.cleanup_test_data()
+        finally:
+            await self.session.aclose()
+            await self.mongo_client.close()
+
+    async def run_test(self, name, method, endpoint, expected_status, data=None, files=None, headers=None, check_body=True,
+                       expected_content_type=None, expected_body=None):
+        """Run a single API test (check_body=False only checks the status and headers)"""
+        url = self._api_base + endpoint if not endpoint.startswith('http') else endpoint
 
         self.tests_run += 1
-        print(f"\n🔍 Testing {name}...")
-        print(f"   URL: {url}")
+        # Collected and written once per test: one write instead of several flushing prints
+        log = [f"\n🔍 Testing {name}...", f"   URL: {url}"]
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=test_headers)
-            elif method == 'POST':
-                if files:
-                    # Remove Content-Type for multipart/form-data
-                    test_headers.pop('Content-Type', None)
-                    response = requests.post(url, files=files, data=data, headers=test_headers)
-                else:
-                    response = requests.post(url, json=data, headers=test_headers)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=test_headers)
+            # Authorization comes from the client defaults and Content-Type from the body kind
+            request_kwargs = {"headers": headers}
+            if files:
+                request_kwargs["files"] = files
+                request_kwargs["data"] = data
+            elif data:
+                request_kwargs["json"] = data
+            if check_body:
+                response = await self.session.request(method, url, **request_kwargs)
+            else:
+                # Stop after the status line and headers; the body is never downloaded
+                async with self.session.stream(method, url, **request_kwargs) as response:
+                    pass
 
             success = response.status_code == expected_status
+            # Optional exact checks for raw bodies such as image blobs
+            mismatch = None
+            content_type = response.headers.get("content-type", "")
+            if success and expected_content_type and not content_type.startswith(expected_content_type):
+                mismatch = f"Expected Content-Type {expected_content_type}, got {content_type}"
+            elif success and expected_body is not None and response.content != expected_body:
+                mismatch = f"Expected {len(expected_body)} body bytes, got {len(response.content)} different ones"
+            success = success and mismatch is None
+            # Only parse bodies that claim to be JSON (proxy 502s return HTML, the export CSV)
+            is_json = "json" in content_type
             if success:
                 self.tests_passed += 1
-                print(f"✅ Passed - Status: {response.status_code}")
+                log.append(f"✅ Passed - Status: {response.status_code}")
+                if not check_body:
+                    log.append(f"   Content-Type: {response.headers.get('content-type')}")
+                    return True, {}
+                if not is_json:
+                    return True, response.text if content_type.startswith("text/") else response.content
                 try:
-                    response_data = response.json()
-                    print(f"   Response: {json.dumps(response_data, indent=2)[:200]}...")
-                    return True, response_data
-                except:
+                    response_data = json_loads(response.content)
+                except ValueError:
                     return True, response.text
+                if VERBOSE:
+                    log.append(f"   Response: {json_pretty(response_data)[:200]}...")
+                elif isinstance(response_data, dict):
+                    log.append(f"   Response keys: {list(response_data)[:5]}")
+                else:
+                    log.append(f"   Response: {type(response_data).__name__}")
+                return True, response_data
             else:
-                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
-                try:
-                    error_data = response.json()
-                    print(f"   Error: {error_data}")
-                except:
-                    print(f"   Error: {response.text}")
+                if mismatch:
+                    log.append(f"❌ Failed - {mismatch}")
+                    return False, {}
+                log.append(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
+                if not check_body:
+                    return False, {}
+                error_data = None
+                if is_json:
+                    try:
+                        error_data = json_loads(response.content)
+                    except ValueError:
+                        pass
+                log.append(f"   Error: {error_data if error_data is not None else response.text[:500]}")
                 return False, {}
 
         except Exception as e:
-            print(f"❌ Failed - Error: {str(e)}")
+            log.append(f"❌ Failed - Error: {str(e)}")
             return False, {}
+        finally:
+            sys.stdout.write("\n".join(log) + "\n")
+
+    async def insert_user_and_session(self, user_id, session_token):
+        """Insert a user and a 7-day session for it directly into MongoDB"""
+        now = datetime.now(timezone.utc)
+        await self.mongo.users.insert_one({
+            "user_id": user_id,
+            "email": f"{user_id}@example.com",
+            "name": f"Test User {user_id}",
+            "picture": "https://via.placeholder.com/150",
+            "created_at": now
+        })
+        await self.mongo.user_sessions.insert_one({
+            "user_id": user_id,
+            "session_token": session_token,
+            "expires_at": now + timedelta(days=7),
+            "created_at": now
+        })
 
-    def create_test_user_and_session(self):
+    async def create_test_user_and_session(self):
         """Create test user and session using MongoDB"""
         print("\n🔧 Creating test user and session...")
         
@@ -75,48 +203,22 @@ class MedReadAPITester:
         user_id = f"test-user-{timestamp}"
         session_token = f"test_session_{timestamp}"
         
-        # MongoDB command to create test user and session
-        mongo_cmd = f"""
-        use('test_database');
-        var userId = '{user_id}';
-        var sessionToken = '{session_token}';
-        db.users.insertOne({{
-          user_id: userId,
-          email: 'test.user.{timestamp}@example.com',
-          name: 'Test User {timestamp}',
-          picture: 'https://via.placeholder.com/150',
-          created_at: new Date()
-        }});
-        db.user_sessions.insertOne({{
-          user_id: userId,
-          session_token: sessionToken,
-          expires_at: new Date(Date.now() + 7*24*60*60*1000),
-          created_at: new Date()
-        }});
-        print('Session token: ' + sessionToken);
-        print('User ID: ' + userId);
-        """
-        
         try:
-            result = subprocess.run(['mongosh', '--eval', mongo_cmd], 
-                                  capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
-                print(f"✅ Test user created successfully")
-                print(f"   User ID: {user_id}")
-                print(f"   Session Token: {session_token}")
-                self.user_id = user_id
-                self.session_token = session_token
-                return True
-            else:
-                print(f"❌ Failed to create test user: {result.stderr}")
-                return False
+            await self.insert_user_and_session(user_id, session_token)
+            print(f"✅ Test user created successfully")
+            print(f"   User ID: {user_id}")
+            print(f"   Session Token: {session_token}")
+            self.user_id = user_id
+            self.session_token = session_token
+            self.session.headers["Authorization"] = f"Bearer {session_token}"
+            return True
         except Exception as e:
             print(f"❌ Error creating test user: {str(e)}")
             return False
 
-    def test_root_endpoint(self):
+    async def test_root_endpoint(self):
         """Test /api/ root endpoint"""
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Root API Endpoint",
             "GET",
             "",
@@ -124,9 +226,9 @@ class MedReadAPITester:
         )
         return success
 
-    def test_auth_me(self):
+    async def test_auth_me(self):
         """Test /api/auth/me endpoint"""
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Auth Me Endpoint",
             "GET",
             "auth/me",
@@ -134,24 +236,18 @@ class MedReadAPITester:
         )
         return success
 
-    def test_image_upload(self):
+    async def test_image_upload(self):
         """Test /api/images/upload endpoint"""
-        # Create a simple test image (1x1 pixel PNG)
-        test_image_data = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg==')
-        
         files = {
-            'file': ('test_image.png', test_image_data, 'image/png')
-        }
-        data = {
-            'category': 'cancer'
+            'file': ('test_image.png', TEST_PNG_BYTES, 'image/png')
         }
         
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Image Upload",
             "POST",
             "images/upload",
             200,
-            data=data,
+            data=self._IMAGE_UPLOAD_FORM_DATA,
             files=files
         )
         
@@ -161,9 +257,45 @@ class MedReadAPITester:
         
         return success
 
-    def test_get_images(self):
+    async def test_image_blob(self):
+        """Test /api/images/{id}/blob returns the uploaded bytes to their owner"""
+        if not self.image_id:
+            print("❌ Skipping image blob test - no image ID")
+            return False
+        
+        success, response = await self.run_test(
+            "Get Image Blob",
+            "GET",
+            f"images/{self.image_id}/blob",
+            200,
+            expected_content_type="image/png",
+            expected_body=TEST_PNG_BYTES
+        )
+        return success
+
+    async def test_image_blob_other_user(self):
+        """Test /api/images/{id}/blob hides an image from other users"""
+        if not self.image_id:
+            print("❌ Skipping other-user image blob test - no image ID")
+            return False
+        
+        timestamp = int(datetime.now().timestamp())
+        self.other_user_id = f"test-other-user-{timestamp}"
+        self.other_session_token = f"test_other_session_{timestamp}"
+        await self.insert_user_and_session(self.other_user_id, self.other_session_token)
+        
+        success, response = await self.run_test(
+            "Get Other User's Image Blob",
+            "GET",
+            f"images/{self.image_id}/blob",
+            404,
+            headers={"Authorization": f"Bearer {self.other_session_token}"}
+        )
+        return success
+
+    async def test_get_images(self):
         """Test /api/images endpoint"""
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Get Images",
             "GET",
             "images",
@@ -171,9 +303,9 @@ class MedReadAPITester:
         )
         return success
 
-    def test_image_stats(self):
+    async def test_image_stats(self):
         """Test /api/images/stats endpoint"""
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Image Stats",
             "GET",
             "images/stats",
@@ -181,9 +313,9 @@ class MedReadAPITester:
         )
         return success
 
-    def test_start_session(self):
+    async def test_start_session(self):
         """Test /api/sessions/start endpoint"""
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Start Reading Session",
             "POST",
             "sessions/start",
@@ -193,20 +325,21 @@ class MedReadAPITester:
         
         if success and 'session' in response:
             self.session_id = response['session']['session_id']
+            self._session_url = f"sessions/{self.session_id}"
             print(f"   Started session ID: {self.session_id}")
         
         return success
 
-    def test_session_response(self):
+    async def test_session_response(self):
         """Test /api/sessions/{id}/response endpoint"""
         if not self.session_id or not self.image_id:
             print("❌ Skipping session response test - no session or image ID")
             return False
             
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Submit Session Response",
             "POST",
-            f"sessions/{self.session_id}/response",
+            f"{self._session_url}/response",
             200,
             data={
                 "image_id": self.image_id,
@@ -216,123 +349,177 @@ class MedReadAPITester:
         )
         return success
 
-    def test_pause_session(self):
+    async def test_pause_session(self):
         """Test /api/sessions/{id}/pause endpoint"""
         if not self.session_id:
             print("❌ Skipping pause test - no session ID")
             return False
             
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Pause Session",
             "POST",
-            f"sessions/{self.session_id}/pause",
+            f"{self._session_url}/pause",
             200
         )
         return success
 
-    def test_resume_session(self):
+    async def test_resume_session(self):
         """Test /api/sessions/{id}/resume endpoint"""
         if not self.session_id:
             print("❌ Skipping resume test - no session ID")
             return False
             
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Resume Session",
             "POST",
-            f"sessions/{self.session_id}/resume",
+            f"{self._session_url}/resume",
             200
         )
         return success
 
-    def test_complete_session(self):
+    async def test_resume_legacy_session(self):
+        """Test /api/sessions/{id}/resume on a session paused by an older build (ISO-string paused_at)"""
+        session_id = f"legacy_{self.user_id}"
+        paused_at = datetime.now(timezone.utc) - timedelta(seconds=5)
+        await self.mongo.reading_sessions.insert_one({
+            "session_id": session_id,
+            "user_id": self.user_id,
+            "status": "paused",
+            "started_at": paused_at,
+            "paused_at": paused_at.isoformat(),
+            "pause_duration_ms": 0,
+            "total_images": 0,
+            "images_reviewed": 0,
+            "correct_count": 0,
+            "total_time_ms": 0
+        })
+        
+        success, response = await self.run_test(
+            "Resume Legacy Session",
+            "POST",
+            f"sessions/{session_id}/resume",
+            200
+        )
+        if not success:
+            return False
+        
+        session = await self.mongo.reading_sessions.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "pause_duration_ms": 1}
+        )
+        if session["pause_duration_ms"] < 5000:
+            # The request succeeded but the legacy pause was dropped
+            self.tests_passed -= 1
+            print(f"❌ Legacy pause not counted - pause_duration_ms: {session['pause_duration_ms']}")
+            return False
+        print(f"   Legacy pause duration: {session['pause_duration_ms']} ms")
+        return True
+
+    async def test_complete_session(self):
         """Test /api/sessions/{id}/complete endpoint"""
         if not self.session_id:
             print("❌ Skipping complete test - no session ID")
             return False
             
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Complete Session",
             "POST",
-            f"sessions/{self.session_id}/complete",
+            f"{self._session_url}/complete",
             200
         )
         return success
 
-    def test_session_csv(self):
+    async def test_session_csv(self):
         """Test /api/sessions/{id}/csv endpoint"""
         if not self.session_id:
             print("❌ Skipping CSV test - no session ID")
             return False
             
-        success, response = self.run_test(
+        success, response = await self.run_test(
             "Get Session CSV",
             "GET",
-            f"sessions/{self.session_id}/csv",
-            200
+            f"{self._session_url}/csv",
+            200,
+            check_body=False
         )
         return success
 
-    def cleanup_test_data(self):
+    async def cleanup_test_data(self):
         """Clean up test data"""
         print("\n🧹 Cleaning up test data...")
         
         if self.user_id:
-            mongo_cmd = f"""
-            use('test_database');
-            db.users.deleteMany({{user_id: '{self.user_id}'}});
-            db.user_sessions.deleteMany({{user_id: '{self.user_id}'}});
-            db.images.deleteMany({{user_id: '{self.user_id}'}});
-            db.reading_sessions.deleteMany({{user_id: '{self.user_id}'}});
-            db.session_responses.deleteMany({{session_id: '{self.session_id}'}});
-            """
-            
+            user_ids = {"$in": [self.user_id, self.other_user_id]}
             try:
-                subprocess.run(['mongosh', '--eval', mongo_cmd], 
-                              capture_output=True, text=True, timeout=30)
+                # Independent collections, so delete from all of them concurrently
+                await asyncio.gather(
+                    self.mongo.users.delete_many({"user_id": user_ids}),
+                    self.mongo.user_sessions.delete_many({"user_id": user_ids}),
+                    self.mongo.images.delete_many({"user_id": self.user_id}),
+                    self.mongo.image_category_counts.delete_many({"user_id": self.user_id}),
+                    self.mongo.reading_sessions.delete_many({"user_id": self.user_id}),
+                    self.mongo.session_responses.delete_many({"session_id": self.session_id})
+                )
                 print("✅ Test data cleaned up")
             except Exception as e:
                 print(f"⚠️  Warning: Could not clean up test data: {str(e)}")
 
-def main():
+async def run_all_tests():
     print("🚀 Starting MedRead API Tests")
     print("=" * 50)
     
-    tester = MedReadAPITester()
-    
-    # Step 1: Test root endpoint (no auth required)
-    if not tester.test_root_endpoint():
-        print("❌ Root endpoint failed, stopping tests")
-        return 1
-    
-    # Step 2: Create test user and session
-    if not tester.create_test_user_and_session():
-        print("❌ Failed to create test user, stopping tests")
-        return 1
-    
-    # Step 3: Test authenticated endpoints
-    tests = [
-        tester.test_auth_me,
-        tester.test_image_upload,
-        tester.test_get_images,
-        tester.test_image_stats,
-        tester.test_start_session,
-        tester.test_session_response,
-        tester.test_pause_session,
-        tester.test_resume_session,
-        tester.test_complete_session,
-        tester.test_session_csv
-    ]
-    
-    for test in tests:
-        try:
-            test()
-        except Exception as e:
-            print(f"❌ Test failed with exception: {str(e)}")
-    
-    # Cleanup
-    tester.cleanup_test_data()
+    async with MedReadAPITester() as tester:
+        # Step 1: Test root endpoint (no auth required)
+        if not await tester.test_root_endpoint():
+            print("❌ Root endpoint failed, stopping tests")
+            return 1
+        
+        # Step 2: Create test user and session
+        if not await tester.create_test_user_and_session():
+            print("❌ Failed to create test user, stopping tests")
+            return 1
+        
+        # Step 3: Test authenticated endpoints
+        async def run_safely(test):
+            try:
+                await test()
+            except Exception as e:
+                print(f"❌ Test failed with exception: {str(e)}")
+        
+        # These have no data dependencies on each other, so run them concurrently
+        # (the upload also provides the image ID used by the session tests)
+        independent_tests = [
+            tester.test_auth_me,
+            tester.test_get_images,
+            tester.test_image_stats,
+            tester.test_image_upload,
+            tester.test_resume_legacy_session
+        ]
+        
+        # Both need the uploaded image, and the second one adds a user of its own
+        image_tests = [
+            tester.test_image_blob,
+            tester.test_image_blob_other_user
+        ]
+        
+        # The session lifecycle has to run in order
+        session_tests = [
+            tester.test_start_session,
+            tester.test_session_response,
+            tester.test_pause_session,
+            tester.test_resume_session,
+            tester.test_complete_session,
+            tester.test_session_csv
+        ]
+        
+        await asyncio.gather(*(run_safely(test) for test in independent_tests))
+        sys.stdout.flush()
+        
+        for test in image_tests + session_tests:
+            await run_safely(test)
+        sys.stdout.flush()
     
-    # Print results
+    # Print results (test data was cleaned up when the tester closed)
     print("\n" + "=" * 50)
     print(f"📊 Tests passed: {tester.tests_passed}/{tester.tests_run}")
     
@@ -343,5 +530,10 @@ def main():
         print("❌ Some tests failed")
         return 1
 
+def main():
+    # Output is flushed explicitly between test phases rather than on every line
+    sys.stdout.reconfigure(line_buffering=False)
+    return asyncio.run(run_all_tests())
+
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -20,6 +20,12 @@ import {
   AlertDialogTitle,
 } from "@/components/ui/alert-dialog";
 
+// Public CDN URLs and legacy inline data can go straight into <img>. Anything else
+// comes from the blob endpoint through axios, because an <img> request only sends
+// the cookie and Bearer-token users would get a 401.
+const directImageSrc = (image) =>
+  image.image_url || image.image_data || image.thumbnail_url;
+
 export default function ReadingSession({ user }) {
   const { sessionId } = useParams();
   const navigate = useNavigate();
@@ -36,6 +42,9 @@ export default function ReadingSession({ user }) {
   const [submitting, setSubmitting] = useState(false);
   const [lastResult, setLastResult] = useState(null);
   const [preloadedImage, setPreloadedImage] = useState(null);
+  const [blobUrls, setBlobUrls] = useState({});
+  const blobUrlsRef = useRef({});
+  const requestedBlobsRef = useRef(new Set());
   
   // Timer state
   const [elapsedTime, setElapsedTime] = useState(0);
@@ -44,17 +53,48 @@ export default function ReadingSession({ user }) {
   const customInputStartRef = useRef(null);
   const customInputTimeRef = useRef(0);
 
-  // Pre-cache next image
+  // Fetch an image from the blob endpoint with the session's credentials
+  const loadImageBlob = useCallback(async (image) => {
+    if (!image || directImageSrc(image) || requestedBlobsRef.current.has(image.image_id)) return;
+    
+    requestedBlobsRef.current.add(image.image_id);
+    try {
+      const response = await axios.get(`/images/${image.image_id}/blob`, {
+        responseType: "blob"
+      });
+      const url = URL.createObjectURL(response.data);
+      blobUrlsRef.current[image.image_id] = url;
+      setBlobUrls((prev) => ({ ...prev, [image.image_id]: url }));
+    } catch (error) {
+      requestedBlobsRef.current.delete(image.image_id);
+    }
+  }, []);
+
+  // Load the current image and pre-cache the next one
   useEffect(() => {
+    loadImageBlob(images[currentIndex]);
+    
     if (images.length > 0 && currentIndex < images.length - 1) {
       const nextImage = images[currentIndex + 1];
-      if (nextImage?.image_data) {
-        const img = new Image();
-        img.src = nextImage.image_data;
-        setPreloadedImage(img);
+      if (nextImage) {
+        const src = directImageSrc(nextImage);
+        if (src) {
+          const img = new Image();
+          img.src = src;
+          setPreloadedImage(img);
+        } else {
+          loadImageBlob(nextImage);
+        }
       }
     }
-  }, [currentIndex, images]);
+  }, [currentIndex, images, loadImageBlob]);
+
+  // Release fetched image blobs when leaving the session
+  useEffect(() => {
+    return () => {
+      Object.values(blobUrlsRef.current).forEach((url) => URL.revokeObjectURL(url));
+    };
+  }, []);
 
   // Fetch session data if not passed
   useEffect(() => {
@@ -311,7 +351,7 @@ export default function ReadingSession({ user }) {
           ) : currentImage ? (
             <>
               <img 
-                src={currentImage.image_data || currentImage.thumbnail_url}
+                src={directImageSrc(currentImage) || blobUrls[currentImage.image_id]}
                 alt="Medical Image"
                 className="max-w-full max-h-full object-contain fade-in"
                 data-testid="current-image"